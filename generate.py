@@ -1,20 +1,31 @@
 #!/usr/bin/env python3
 
 import argparse
-import imp
+import hashlib
+import importlib.util
 import logging
 import os
 from os.path import join
 from shutil import rmtree
 import sys
-from typing import List
+from typing import List, Optional, Tuple
 
 sys.path.append("stone")
+import stone
 from stone.compiler import BackendException, Compiler
 from stone.frontend.exception import InvalidSpec
 from stone.frontend.frontend import specs_to_ir
 
 
+DESTINATIONS = {
+    "rust": join("src", "generated"),
+    "test": join("tests", "generated"),
+}
+
+# Written into each output directory; holds a digest of the inputs that produced its contents.
+DIGEST_FILE = ".stonegen-digest"
+
+
 class CodegenFailed(Exception):
     pass
 
@@ -27,9 +38,106 @@ def spec_files(spec_root: str) -> List[str]:
     return specs
 
 
-def generate_code(spec_root: str, gen_rust: bool, gen_test: bool):
+def python_sources(root: str) -> List[str]:
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d != "__pycache__")
+        sources.extend(join(dirpath, name) for name in sorted(filenames) if name.endswith(".py"))
+    return sources
+
+
+def inputs_digest(specs: List[Tuple[str, str]], target: str) -> str:
+    """
+    Hash everything that goes into generating a target: the spec files, the generator code, this
+    script, and the Stone package doing the compiling.
+    """
+    h = hashlib.blake2b(target.encode())
+    h.update(b"\0" + getattr(stone, "__version__", "").encode())
+    for path, text in sorted((os.path.basename(path), text) for path, text in specs):
+        h.update(b"\0" + path.encode() + b"\0" + text.encode())
+    stone_root = os.path.dirname(os.path.abspath(stone.__file__))
+    code = [(os.path.relpath(path, os.path.dirname(stone_root)), path)
+            for path in python_sources(stone_root)]
+    code += [(path, path) for path in python_sources("generator")]
+    code.append((os.path.basename(__file__), __file__))
+    for name, path in code:
+        with open(path, "rb") as f:
+            h.update(b"\0" + name.encode() + b"\0" + f.read())
+    return h.hexdigest()
+
+
+def read_digest(destination: str) -> Optional[str]:
+    try:
+        with open(join(destination, DIGEST_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def update_tree(source: str, destination: str):
+    """
+    Make `destination` match `source`, then remove `source`.
+
+    Files whose contents haven't changed are left alone, so their modification times stay put and
+    cargo doesn't rebuild anything on their account.
+    """
+    new_files = set()
+    for dirpath, _, filenames in os.walk(source):
+        target_dir = os.path.normpath(join(destination, os.path.relpath(dirpath, source)))
+        os.makedirs(target_dir, exist_ok=True)
+        for filename in filenames:
+            src = join(dirpath, filename)
+            dst = join(target_dir, filename)
+            new_files.add(dst)
+            with open(src, "rb") as f:
+                contents = f.read()
+            try:
+                with open(dst, "rb") as f:
+                    unchanged = f.read() == contents
+            except FileNotFoundError:
+                unchanged = False
+            if not unchanged:
+                os.replace(src, dst)
+
+    for dirpath, _, filenames in os.walk(destination, topdown=False):
+        for filename in filenames:
+            path = join(os.path.normpath(dirpath), filename)
+            if path not in new_files:
+                os.remove(path)
+        if not os.listdir(dirpath) and os.path.normpath(dirpath) != os.path.normpath(destination):
+            os.rmdir(dirpath)
+
+    rmtree(source)
+
+
+def load_backend(target: str):
+    """
+    Import the Stone backend module for a target, reusing it if it has already been loaded.
+    """
+    name = "{}_backend".format(target)
+    module = sys.modules.get(name)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(
+            name, join("generator", "{}.stoneg.py".format(target)))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+        except BaseException:
+            del sys.modules[name]
+            raise
+    return module
+
+
+def generate_code(spec_root: str, gen_rust: bool, gen_test: bool, force: bool = False,
+                  jobs: Optional[int] = None, validate_generated: bool = False):
     """
     This is basically stone/stone/cli.py stripped down and customized to our needs.
+
+    Targets whose inputs haven't changed since they were last generated are skipped, unless
+    `force` is set. `jobs` limits how many processes the test generator uses, and
+    `validate_generated` makes it check every test value's JSON against the reference serializer; as
+    that's a check on the output rather than an input to it, the tests are always regenerated then.
     """
 
     targets = ["rust"] if gen_rust else []
@@ -42,6 +150,17 @@ def generate_code(spec_root: str, gen_rust: bool, gen_test: bool):
         with open(path) as f:
             specs.append((path, f.read()))
 
+    digests = {}
+    for target in targets:
+        digest = inputs_digest(specs, target)
+        if not force and not (target == "test" and validate_generated) \
+                and read_digest(DESTINATIONS[target]) == digest:
+            print("{} is up to date".format(DESTINATIONS[target]))
+        else:
+            digests[target] = digest
+    if not digests:
+        return
+
     try:
         api = specs_to_ir(specs)
     except InvalidSpec as e:
@@ -49,24 +168,29 @@ def generate_code(spec_root: str, gen_rust: bool, gen_test: bool):
         raise CodegenFailed
 
     sys.path.append("generator")
-    for target in targets:
+    for target, digest in digests.items():
+        destination = DESTINATIONS[target]
+
         print("Running generator for {}".format(target))
         try:
-            backend_module = imp.load_source(
-                '{}_backend'.format(target), join("generator", "{}.stoneg.py".format(target)))
+            backend_module = load_backend(target)
         except Exception:
             print("error: Importing backend \"{}\" module raised an exception: ".format(
                 target), file=sys.stderr)
             raise
 
-        destination = {
-            "rust": join("src", "generated"),
-            "test": join("tests", "generated"),
-        }[target]
+        # Generate into a staging directory first, so unchanged files can be left untouched.
+        staging = destination + ".new"
+        rmtree(staging, ignore_errors=True)
 
-        rmtree(destination, ignore_errors=True)
+        backend_args = []
+        if target == "test":
+            if jobs is not None:
+                backend_args += ["--jobs", str(jobs)]
+            if validate_generated:
+                backend_args += ["--validate-generated"]
 
-        c = Compiler(api, backend_module, [], destination)
+        c = Compiler(api, backend_module, backend_args, staging)
         try:
             c.build()
         except BackendException as e:
@@ -76,7 +200,7 @@ def generate_code(spec_root: str, gen_rust: bool, gen_test: bool):
 
         if os.linesep != "\n":
             # If this is Windows, rewrite the files to have the proper line ending.
-            for dirent in os.scandir(destination):
+            for dirent in os.scandir(staging):
                 if dirent.is_file():
                     crlf_path = dirent.path + "_"
                     with open(dirent.path) as lf, open(crlf_path, "w") as crlf:
@@ -84,6 +208,13 @@ def generate_code(spec_root: str, gen_rust: bool, gen_test: bool):
                             crlf.write(line)
                     os.replace(crlf_path, dirent.path)
 
+        update_tree(staging, destination)
+
+        # Only record the digest once everything else is in place, so that if the update is
+        # interrupted, the next run doesn't take the half-updated tree as up to date.
+        with open(join(destination, DIGEST_FILE), "w") as f:
+            f.write(digest + "\n")
+
 
 def main():
     parser = argparse.ArgumentParser(description="generate SDK code from the Stone API spec")
@@ -91,6 +222,14 @@ def main():
                         help="Path to the API spec submodule.")
     parser.add_argument("--gen-rust", action="store_true")
     parser.add_argument("--gen-test", action="store_true")
+    parser.add_argument("--force", action="store_true",
+                        help="Regenerate even if the inputs haven't changed.")
+    parser.add_argument("--jobs", type=int,
+                        help="Number of processes to generate tests in on Linux "
+                             "(default: one per CPU).")
+    parser.add_argument("--validate-generated", action="store_true",
+                        help="Also serialize every test value with the reference Python SDK, "
+                             "and fail if that differs from the JSON built directly.")
 
     args = parser.parse_args()
     if not args.gen_rust and not args.gen_test:
@@ -100,7 +239,8 @@ def main():
     logging.basicConfig(level=logging.INFO)
 
     try:
-        generate_code(args.spec_path, args.gen_rust, args.gen_test)
+        generate_code(args.spec_path, args.gen_rust, args.gen_test, args.force, args.jobs,
+                      args.validate_generated)
     except CodegenFailed:
         exit(2)
 
@@ -950,79 +950,100 @@ class RustBackend(RustHelperBackend):
                         if not self.is_closed_union(typ) or has_inner != variants:
                             self.emit(u'_ => None,')
 
+        # Find variants that have documentation and/or an inner value, and use that for the
+        # Display representation of the error.
+        # Each entry is a list of match patterns and the expression they evaluate to.
+        doc_variants = []
+        any_skipped = False
+
+        # Variants that display the same fixed message share one match arm, so that each string
+        # literal is only emitted once.
+        str_arms = {}
+
+        def write_str_arm(pattern, msg):
+            if msg in str_arms:
+                str_arms[msg][0].append(pattern)
+            else:
+                str_arms[msg] = ([pattern], u'f.write_str("' + msg + u'")')
+                doc_variants.append(str_arms[msg])
+
+        for variant in variants:
+            var_exp = type_name + u'::' + self.enum_variant_name(variant)
+            msg = ''
+            args = ''
+            if variant.doc:
+                # Use the first line of documentation.
+                msg = variant.doc.split('\n')[0]
+
+                # If the line has doc references, it's not going to make a good display
+                # string, so only include it if it has none:
+                if msg != self.process_doc(msg, lambda tag, value: ''):
+                    msg = ""
+
+            inner_fmt = ''
+            if self._is_error_type(variant.data_type):
+                # include the Display representation of the inner error.
+                inner_fmt = '{}'
+            elif not ir.is_void_type(variant.data_type):
+                # Include the Debug representation of the inner value.
+                inner_fmt = '{:?}'
+
+                if not msg:
+                    # But if there's no message here already, prefix it with the name of the
+                    # variant so there's some context.
+                    msg = variant.name
+
+            if inner_fmt:
+                # Special case: if the inner value is an Option, spit out two match cases,
+                # one for if it's Some, and one for None.
+                # This is to avoid printing something like "foobar: None" if we're using
+                # the Debug repr, which looks confusing and adds nothing of value to the
+                # message.
+                if ir.is_nullable_type(variant.data_type):
+                    write_str_arm(var_exp + u'(None)', msg)
+                    var_exp += u'(Some(inner))'
+                else:
+                    var_exp += u'(inner)'
+
+                if msg.endswith(u'.'):
+                    msg = msg[:-1]
+                if msg:
+                    msg += u': '
+                msg += inner_fmt
+                args = u'inner'
+
+            if msg:
+                if not args:
+                    write_str_arm(var_exp, msg)
+                else:
+                    doc_variants.append(
+                        ([var_exp], u'write!(f, "{}", {})'.format(msg, args)))
+            else:
+                any_skipped = True
+        # for variant in variants
+
+        # Anything not covered by an arm falls back on the Debug representation.
+        has_fallback = not self.is_closed_union(typ) or any_skipped
+
         self.emit()
         with self.block(u'impl ::std::fmt::Display for {}'.format(type_name)):
+            if len(doc_variants) == 1 and doc_variants[0][1].startswith(u'f.write_str(') \
+                    and not has_fallback:
+                # Trivial body, just one f.write_str; let it be inlined into callers.
+                self.emit(u'#[inline]')
+            elif len(doc_variants) > 32:
+                # Huge match; keep it out of callers to cut down on codegen size.
+                self.emit(u'#[inline(never)]')
             with self.emit_rust_function_def(
                     u'fmt',
                     [u'&self', u'f: &mut ::std::fmt::Formatter<\'_>'],
                     u'::std::fmt::Result'):
-
-                # Find variants that have documentation and/or an inner value, and use that for the
-                # Display representation of the error.
-                doc_variants = []
-                any_skipped = False
-                for variant in variants:
-                    var_exp = u'{}::{}'.format(type_name, self.enum_variant_name(variant))
-                    msg = ''
-                    args = ''
-                    if variant.doc:
-                        # Use the first line of documentation.
-                        msg = variant.doc.split('\n')[0]
-
-                        # If the line has doc references, it's not going to make a good display
-                        # string, so only include it if it has none:
-                        if msg != self.process_doc(msg, lambda tag, value: ''):
-                            msg = ""
-
-                    inner_fmt = ''
-                    if self._is_error_type(variant.data_type):
-                        # include the Display representation of the inner error.
-                        inner_fmt = '{}'
-                    elif not ir.is_void_type(variant.data_type):
-                        # Include the Debug representation of the inner value.
-                        inner_fmt = '{:?}'
-
-                        if not msg:
-                            # But if there's no message here already, prefix it with the name of the
-                            # variant so there's some context.
-                            msg = variant.name
-
-                    if inner_fmt:
-                        # Special case: if the inner value is an Option, spit out two match cases,
-                        # one for if it's Some, and one for None.
-                        # This is to avoid printing something like "foobar: None" if we're using
-                        # the Debug repr, which looks confusing and adds nothing of value to the
-                        # message.
-                        if ir.is_nullable_type(variant.data_type):
-                            doc_variants.append(
-                                u'{}(None) => f.write_str("{}"),'.format(var_exp, msg))
-                            var_exp += u'(Some(inner))'
-                        else:
-                            var_exp += u'(inner)'
-
-                        if msg.endswith(u'.'):
-                            msg = msg[:-1]
-                        if msg:
-                            msg += u': '
-                        msg += inner_fmt
-                        args = u'inner'
-
-                    if msg:
-                        if not args:
-                            doc_variants.append(u'{} => f.write_str("{}"),'.format(var_exp, msg))
-                        else:
-                            doc_variants.append(u'{} => write!(f, "{}", {}),'.format(
-                                var_exp, msg, args))
-                    else:
-                        any_skipped = True
-                # for variant in variants
-
                 if doc_variants:
                     with self.block(u'match self'):
-                        for match_case in doc_variants:
-                            self.emit(match_case)
+                        for patterns, expr in doc_variants:
+                            self.emit(u'{} => {},'.format(u' | '.join(patterns), expr))
 
-                        if not self.is_closed_union(typ) or any_skipped:
+                        if has_fallback:
                             # fall back on the Debug representation
                             self.emit(u'_ => write!(f, "{:?}", *self),')
                 else:
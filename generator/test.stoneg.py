@@ -1,4 +1,11 @@
+import argparse
+import base64
+from concurrent.futures import ProcessPoolExecutor
 import datetime
+from functools import lru_cache
+import importlib
+from json import dumps as json_dumps
+import multiprocessing
 import os.path
 import re
 import string
@@ -6,7 +13,68 @@ import sys
 
 from rust import RustHelperBackend
 from stone import ir
-from stone.backends.python_helpers import fmt_class as fmt_py_class
+from stone.backends.python_helpers import fmt_class
+
+if sys.version_info >= (3, 11):
+    from re import _parser as sre_parse
+else:
+    import sre_parse
+
+# Python class names for the reference SDK get looked up over and over for the same types.
+fmt_py_class = lru_cache(maxsize=None)(fmt_class)
+
+
+_OTHER_TAG = '{".tag": "other"'
+_BOGUS_TAG = '{".tag": "dropbox-sdk-rust-bogus-test-variant"'
+
+
+_HEADER = u'''\
+// DO NOT EDIT
+// This file was @generated by Stone
+
+#![allow(bad_style)]
+
+#![allow(
+    clippy::float_cmp,
+    clippy::unreadable_literal,
+    clippy::cognitive_complexity,
+    clippy::collapsible_match,
+    clippy::bool_assert_comparison
+)]
+
+'''
+
+
+# The fixed parts of the tests emitted by TestBackend._emit_tests(). These are always the body of a
+# top-level function, so they're indented accordingly.
+
+# One level of indentation in the emitted code.
+_INDENT = u'    '
+
+_TEST_BODY = u'''\
+    let json = {json};
+    let x = ::serde_json::from_str::<{rust_type}>(json).unwrap();
+{x_asserts}\
+    assert_eq!(x, x.clone());
+'''
+
+_TEST_ROUNDTRIP = u'''\
+
+    let json2 = ::serde_json::to_string(&x).unwrap();
+    let x2 = ::serde_json::from_str::<{rust_type}>(&json2).unwrap();
+{x2_asserts}\
+    assert_eq!(x, x2);
+'''
+
+_TEST_ROUNDTRIP_NO_FIELDS = u'''\
+
+    let json2 = ::serde_json::to_string(&x).unwrap();
+    ::serde_json::from_str::<{rust_type}>(&json2).unwrap();
+'''
+
+_TEST_NOT_SERIALIZABLE = u'''\
+    assert!(::serde_json::to_string(&x).is_err());
+'''
 
 
 class Permissions(object):
@@ -21,6 +89,16 @@ class Permissions(object):
 
 
 class TestBackend(RustHelperBackend):
+    cmdline_parser = argparse.ArgumentParser(prog='test-backend')
+    cmdline_parser.add_argument(
+        '--jobs', type=int, default=0,
+        help='Number of worker processes to generate namespaces in, on Linux. '
+             'Defaults to the number of CPUs.')
+    cmdline_parser.add_argument(
+        '--validate-generated', action='store_true',
+        help='Also serialize every test value with the reference serializer, and fail if that '
+             'differs from the JSON built directly.')
+
     def __init__(self, target_folder_path, args):
         super(TestBackend, self).__init__(target_folder_path, args)
 
@@ -29,82 +107,175 @@ class TestBackend(RustHelperBackend):
         from stone.backends.python_types import PythonTypesBackend
         self.target_path = target_folder_path
         self.ref_path = os.path.join(target_folder_path, 'reference')
-        self.reference = PythonTypesBackend(self.ref_path, args + ["--package", "reference"])
+        self.reference = PythonTypesBackend(self.ref_path, ["--package", "reference"])
         self.reference_impls = {}
 
+        # Test values generated so far; see test_value_for().
+        self._test_values = {}
+
+    # Stone already buffers each file and writes it out in one go, but it also escapes every
+    # emitted line for its placeholder support and then formats the whole buffer again on the way
+    # out. We never use placeholders, and the test files are huge, so skip both steps.
+
+    def emit_raw(self, s):
+        self.lineno += s.count('\n')
+        self.output.append(s)
+
+    def output_buffer_to_string(self):
+        return ''.join(self.output)
+
+    # The same types, fields and variants get named over and over while emitting tests, and the
+    # case conversion behind each name isn't free, so remember the results.
+
+    @lru_cache(maxsize=None)
+    def namespace_name_raw(self, ns_name):
+        return super(TestBackend, self).namespace_name_raw(ns_name)
+
+    @lru_cache(maxsize=None)
+    def struct_name(self, struct):
+        return super(TestBackend, self).struct_name(struct)
+
+    @lru_cache(maxsize=None)
+    def enum_name(self, union):
+        return super(TestBackend, self).enum_name(union)
+
+    @lru_cache(maxsize=None)
+    def field_name_raw(self, name):
+        return super(TestBackend, self).field_name_raw(name)
+
+    @lru_cache(maxsize=None)
+    def enum_variant_name_raw(self, name):
+        return super(TestBackend, self).enum_variant_name_raw(name)
+
+    def test_value_for(self, typ, variant=None, no_optional_fields=False):
+        """
+        Get the test value for a struct or union type: using the given variant for unions and
+        polymorphic structs, and with or without optional fields for other structs.
+
+        Test values are never modified once built, so there's only ever one for each of these, and
+        it is shared between the type's own tests and every field of that type elsewhere.
+        """
+        key = (id(typ), variant.name if variant is not None else None, no_optional_fields)
+        value = self._test_values.get(key)
+        if value is None:
+            if ir.is_union_type(typ):
+                value = TestUnion(self, typ, self.reference_impls, variant)
+            elif typ.has_enumerated_subtypes():
+                value = TestPolymorphicStruct(self, typ, self.reference_impls, variant)
+            else:
+                value = TestStruct(self, typ, self.reference_impls, no_optional_fields)
+            self._test_values[key] = value
+        return value
+
     def make_test_value(self, typ):
         if ir.is_struct_type(typ):
             if typ.has_enumerated_subtypes():
-                return [TestPolymorphicStruct(self, typ, self.reference_impls, variant)
+                return [self.test_value_for(typ, variant)
                     for variant in typ.get_enumerated_subtypes()]
             else:
-                vals = [TestStruct(self, typ, self.reference_impls)]
+                vals = [self.test_value_for(typ)]
                 if typ.all_optional_fields:
                     # If any fields are optional, also emit a test struct that lacks all optional fields.
                     # This helps catch backwards-compat issues as well as checking serialization of None.
-                    vals += [TestStruct(self, typ, self.reference_impls, no_optional_fields=True)]
+                    vals += [self.test_value_for(typ, no_optional_fields=True)]
                 return vals
         elif ir.is_union_type(typ):
-            return [TestUnion(self, typ, self.reference_impls, variant)
-                for variant in typ.all_fields]
+            return [self.test_value_for(typ, variant) for variant in _all_fields(typ)]
         else:
             raise RuntimeError(u'ERROR: type {} is neither struct nor union'
                                 .format(typ))
 
     def generate(self, api):
-        print(u'Generating Python reference code')
-        self.reference.generate(api)
-        with self.output_to_relative_path('reference/__init__.py'):
-            self.emit(u'# this is the Stone-generated reference Python SDK')
-
-        print(u'Loading reference code:')
-        sys.path.insert(0, self.target_path)
-        sys.path.insert(1, "stone")
-        from stone.backends.python_rsrc.stone_serializers import json_encode
-        for ns in api.namespaces:
-            print('\t' + ns)
-            python_ns = ns
-            if ns == 'async':
-                # hack to work around 'async' being a Python3 keyword
-                python_ns = 'async_'
-            self.reference_impls[ns] = __import__('reference.'+python_ns).__dict__[python_ns]
-
-        print(u'Generating test code')
-        for ns in api.namespaces.values():
-            ns_name = self.namespace_name(ns)
-            with self.output_to_relative_path(ns_name + '.rs'):
+        _clear_run_caches()
+        try:
+            print(u'Generating Python reference code')
+            self.reference.generate(api)
+            with self.output_to_relative_path('reference/__init__.py'):
+                self.emit(u'# this is the Stone-generated reference Python SDK')
+
+            print(u'Loading reference code')
+            sys.path.insert(0, self.target_path)
+            sys.path.insert(1, "stone")
+            from stone.backends.python_rsrc.stone_serializers import json_encode
+            self.reference_impls.update({ns: self._load_reference(ns) for ns in api.namespaces})
+
+            print(u'Generating test code')
+            for ns, source in zip(api.namespaces.values(),
+                                  self._map_namespaces(api, json_encode)):
+                with self.output_to_relative_path(self.namespace_name(ns) + '.rs'):
+                    self.emit_raw(source)
+
+            with self.output_to_relative_path('mod.rs'):
                 self._emit_header()
-                for typ in ns.data_types:
-                    self._emit_tests(ns, typ, json_encode)
+                for ns in api.namespaces:
+                    self.emit(u'#[cfg(feature = "dbx_{}")]'.format(ns))
+                    self.emit(u'mod {};'.format(self.namespace_name_raw(ns)))
+                    self.emit()
+        finally:
+            # Don't hold on to this run's API, reference modules and backend once it's over.
+            _clear_run_caches()
+
+    def _load_reference(self, ns):
+        self.logger.debug(u'Loading reference code for %s', ns)
+        python_ns = ns
+        if ns == 'async':
+            # hack to work around 'async' being a Python3 keyword
+            python_ns = 'async_'
+        return _cached_import('reference.' + python_ns)
+
+    def _map_namespaces(self, api, json_encode):
+        """
+        Generate the test code for every namespace, returning the source for each in order.
+
+        Namespaces are independent of each other, so on Linux this is farmed out to forked worker
+        processes: the reference modules and the API can't be pickled, but forked workers inherit
+        them as-is. Forking isn't safe on macOS and isn't available on Windows, so elsewhere, or
+        with --jobs=1, it all happens in this process.
+        """
+        global _fork_state
+        ns_names = list(api.namespaces)
+        jobs = min(self.args.jobs or os.cpu_count() or 1, len(ns_names))
+        if jobs < 2 or not sys.platform.startswith('linux'):
+            return [self.namespace_tests(ns, json_encode) for ns in api.namespaces.values()]
+
+        _fork_state = (self, api, json_encode)
+        try:
+            with ProcessPoolExecutor(max_workers=jobs,
+                                     mp_context=multiprocessing.get_context('fork')) as pool:
+                return list(pool.map(_namespace_tests_in_worker, ns_names))
+        finally:
+            _fork_state = None
+
+    def namespace_tests(self, ns, json_encode):
+        self.clear_output_buffer()
+        self._emit_header()
+        for typ in ns.data_types:
+            self._emit_tests(ns, typ, json_encode)
+
+            if self.is_closed_union(typ):
+                self._emit_closed_union_test(ns, typ)
+        source = self.output_buffer_to_string()
+        self.clear_output_buffer()
+        return source
+
+    def _emit_header(self):
+        self.emit_raw(_HEADER)
 
-                    if self.is_closed_union(typ):
-                        self._emit_closed_union_test(ns, typ)
+    # Lookups into the reference modules, which are made for every test value of every type.
 
-        with self.output_to_relative_path('mod.rs'):
-            self._emit_header()
-            for ns in api.namespaces:
-                self.emit(u'#[cfg(feature = "dbx_{}")]'.format(ns))
-                self.emit(u'mod {};'.format(self.namespace_name_raw(ns)))
-                self.emit()
+    @lru_cache(maxsize=None)
+    def reference_class(self, typ):
+        return self.reference_impls[typ.namespace.name].__dict__[fmt_py_class(typ.name)]
 
-    def _emit_header(self):
-        self.emit(u'// DO NOT EDIT')
-        self.emit(u'// This file was @generated by Stone')
-        self.emit()
-        self.emit(u'#![allow(bad_style)]')
-        self.emit()
-        self.emit(u'#![allow(')
-        self.emit(u'    clippy::float_cmp,')
-        self.emit(u'    clippy::unreadable_literal,')
-        self.emit(u'    clippy::cognitive_complexity,')
-        self.emit(u'    clippy::collapsible_match,')
-        self.emit(u'    clippy::bool_assert_comparison')
-        self.emit(u')]')
-        self.emit()
+    @lru_cache(maxsize=None)
+    def reference_validator(self, typ):
+        return getattr(self.reference_impls[typ.namespace.name],
+                       fmt_py_class(typ.name) + '_validator')
 
     def _emit_tests(self, ns, typ, json_encode):
         ns_name = self.namespace_name(ns)
         type_name = self.struct_name(typ)
+        rust_type = u'::dropbox_sdk::{}::{}'.format(ns_name, type_name)
 
         # The general idea here is to instantiate each type using the reference
         # Python code, put some random data in the fields, serialize it to
@@ -113,13 +284,21 @@ class TestBackend(RustHelperBackend):
         # JSON and desereialize it again, then check the fields of the
         # newly-deserialized struct. This verifies Rust's serializer.
 
+        validator = self.reference_validator(typ)
+        has_fields = bool(_all_fields(typ))
         for test_value in self.make_test_value(typ):
-            pyname = fmt_py_class(typ.name)
-
-            json = json_encode(
-                self.reference_impls[ns.name].__dict__[pyname + '_validator'],
-                test_value.value,
-                Permissions())
+            json = json_dumps(test_value.to_json_obj()) if test_value.has_json_obj else None
+            if json is None or self.args.validate_generated:
+                try:
+                    encoded = json_encode(validator, test_value.value, Permissions())
+                except Exception as e:
+                    raise RuntimeError(u'Error serializing value for {}{}: {}'
+                                       .format(typ.name, test_value.test_suffix(), e))
+                if json is not None and json != encoded:
+                    raise RuntimeError(
+                        u'JSON built for {}{} differs from the reference serializer\'s:\n{}\n{}'
+                        .format(typ.name, test_value.test_suffix(), json, encoded))
+                json = encoded
 
             # "other" is a hardcoded, special-cased tag used by Stone for the
             # catch-all variant of open unions. Let's rewrite it to something
@@ -127,62 +306,67 @@ class TestBackend(RustHelperBackend):
             # Unfortunately this requires mega-hax of rewriting the JSON text,
             # because the Python serializer won't let us give an arbitrary
             # variant name.
-            json = json.replace(
-                    '{".tag": "other"',
-                    '{".tag": "dropbox-sdk-rust-bogus-test-variant"')
+            json = json.replace(_OTHER_TAG, _BOGUS_TAG)
+
+            ctx = {
+                'json': _raw_str(json),
+                'rust_type': rust_type,
+                'x_asserts': self._emitted_asserts(test_value, 'x'),
+            }
+            if test_value.is_serializable() and has_fields:
+                ctx['x2_asserts'] = self._emitted_asserts(test_value, 'x2')
 
             with self._test_fn(type_name + test_value.test_suffix()):
-                self.emit(u'let json = r#"{}"#;'.format(json))
-                self.emit(u'let x = ::serde_json::from_str::<::dropbox_sdk::{}::{}>(json).unwrap();'
-                        .format(ns_name,
-                                self.struct_name(typ)))
-                test_value.emit_asserts(self, 'x')
-                self.emit(u'assert_eq!(x, x.clone());')
+                self.emit_raw(_TEST_BODY.format_map(ctx))
 
                 if test_value.is_serializable():
                     # now serialize it back to JSON, deserialize it again, and
                     # test it again.
-                    self.emit()
-                    self.emit(u'let json2 = ::serde_json::to_string(&x).unwrap();')
-                    de = u'::serde_json::from_str::<::dropbox_sdk::{}::{}>(&json2).unwrap()' \
-                        .format(ns_name,
-                                self.struct_name(typ))
-
-                    if typ.all_fields:
-                        self.emit(u'let x2 = {};'.format(de))
-                        test_value.emit_asserts(self, 'x2')
-                        self.emit(u'assert_eq!(x, x2);')
+                    if has_fields:
+                        self.emit_raw(_TEST_ROUNDTRIP.format_map(ctx))
                     else:
-                        self.emit(u'{};'.format(de))
+                        self.emit_raw(_TEST_ROUNDTRIP_NO_FIELDS.format_map(ctx))
                 else:
                     # assert that serializing it returns an error
-                    self.emit(u'assert!(::serde_json::to_string(&x).is_err());')
+                    self.emit_raw(_TEST_NOT_SERIALIZABLE)
             self.emit()
 
+    def _emitted_asserts(self, test_value, expression_path):
+        """
+        Get the assertions for a test value as text, indented for the body of a test function,
+        instead of emitting them.
+        """
+        lines = []
+        test_value.emit_asserts_to(lines, _INDENT, expression_path)
+        return ''.join(lines)
+
     def _emit_closed_union_test(self, ns, typ):
-        ns_name = self.namespace_name(ns)
         type_name = self.struct_name(typ)
+        rust_type = u'::dropbox_sdk::{}::{}'.format(self.namespace_name(ns), self.enum_name(typ))
         with self._test_fn("ClosedUnion_" + type_name):
             self.emit(u'// This test ensures that an exhaustive match compiles.')
-            self.emit(u'let x: Option<::dropbox_sdk::{}::{}> = None;'.format(
-                ns_name, self.enum_name(typ)))
+            self.emit(u'let x: Option<{}> = None;'.format(rust_type))
             self.emit(u'match x {')
             with self.indent():
                 var_exps = []
+                type_path = rust_type + u'::'
                 for variant in self.get_enum_variants(typ):
-                    v_name = self.enum_variant_name(variant)
-                    var_exp = u'::dropbox_sdk::{}::{}::{}'.format(
-                        ns_name, type_name, v_name)
+                    var_exp = type_path + self.enum_variant_name(variant)
                     if not ir.is_void_type(variant.data_type):
                         var_exp += u'(_)'
                     var_exps += [var_exp]
 
-                self.generate_multiline_list(
-                    [u'None'] + [u'Some({})'.format(exp) for exp in var_exps],
-                    sep=' | ',
-                    skip_last_sep=True,
-                    delim=('', ''),
-                    after=' => ()')
+                patterns = [u'None'] + [u'Some({})'.format(exp) for exp in var_exps]
+                one_line = u' | '.join(patterns) + u' => ()'
+                if self._dent_len() + len(one_line) < 100:
+                    self.emit(one_line)
+                else:
+                    self.generate_multiline_list(
+                        patterns,
+                        sep=' | ',
+                        skip_last_sep=True,
+                        delim=('', ''),
+                        after=' => ()')
             self.emit(u'}')
         self.emit()
 
@@ -191,6 +375,41 @@ class TestBackend(RustHelperBackend):
         return self.emit_rust_function_def(u'test_' + name)
 
 
+@lru_cache(maxsize=None)
+def _all_fields(typ):
+    # Stone works this out afresh on every access, walking up through all the parent types.
+    return typ.all_fields
+
+
+def _clear_run_caches():
+    # These caches are keyed on IR objects or on the backend itself, so nothing in them is any use
+    # to a later run (update_spec.py generates twice in one process).
+    for cached in (_all_fields, _field_kind, _numeric_test_value,
+                   TestBackend.namespace_name_raw, TestBackend.struct_name,
+                   TestBackend.enum_name, TestBackend.field_name_raw,
+                   TestBackend.enum_variant_name_raw, TestBackend.reference_class,
+                   TestBackend.reference_validator):
+        cached.cache_clear()
+
+
+def _cached_import(module_name):
+    # Check sys.modules first, so modules that are already loaded skip the import machinery and
+    # its locking entirely.
+    module = sys.modules.get(module_name)
+    if module is None:
+        module = importlib.import_module(module_name)
+    return module
+
+
+# The backend, API, and JSON encoder, set by TestBackend._map_namespaces() for forked workers.
+_fork_state = None
+
+
+def _namespace_tests_in_worker(ns_name):
+    backend, api, json_encode = _fork_state
+    return backend.namespace_tests(api.namespaces[ns_name], json_encode)
+
+
 class TestField(object):
     def __init__(self, name, python_value, test_value, stone_type, option):
         self.name = name
@@ -199,33 +418,142 @@ class TestField(object):
         self.typ = stone_type
         self.option = option
 
-    def emit_assert(self, codegen, expression_path):
-        extra = ('.' + self.name) if self.name else ''
-        if self.option:
-            expression = '(*' + expression_path + extra + '.as_ref().unwrap())'
+        # What goes either side of the path to the containing value to get at this field. Fields
+        # are shared between all the values that contain them, so work these out just once.
+        extra = ('.' + name) if name else ''
+        if option:
+            self._expression_prefix = '(*'
+            self._expression_suffix = extra + '.as_ref().unwrap())'
+        else:
+            self._expression_prefix = ''
+            self._expression_suffix = extra
+
+        # How to assert on and serialize a primitive-typed value, or None if there's a TestValue to
+        # do that (or we don't know how). These are also looked up just once, for the same reason.
+        if test_value is None:
+            self._assertion = _by_type(_ASSERTIONS, stone_type)
+            self._to_json = _JSON_PRIMITIVES.get(type(stone_type))
+            # Values of primitive types whose serialization we don't know are left to the
+            # reference serializer.
+            self.has_json_obj = self._to_json is not None
         else:
-            expression = expression_path + extra
-
-        if isinstance(self.test_value, TestValue):
-            self.test_value.emit_asserts(codegen, expression)
-        elif ir.is_string_type(self.typ):
-            codegen.emit(u'assert_eq!({}.as_str(), r#"{}"#);'.format(
-                expression, self.value))
-        elif ir.is_numeric_type(self.typ):
-            codegen.emit(u'assert_eq!({}, {});'.format(
-                expression, self.value))
-        elif ir.is_boolean_type(self.typ):
-            codegen.emit(u'assert_eq!({}, {});'.format(
-                expression, 'true' if self.value else 'false'))
-        elif ir.is_timestamp_type(self.typ):
-            codegen.emit(u'assert_eq!({}.as_str(), "{}");'.format(
-                expression, self.value.strftime(self.typ.format)))
-        elif ir.is_bytes_type(self.typ):
-            codegen.emit(u'assert_eq!(&{}, &[{}]);'.format(
-                expression, ",".join(str(x) for x in self.value)))
+            self._assertion = None
+            self._to_json = None
+            self.has_json_obj = test_value.has_json_obj
+
+    def _expression(self, expression_path):
+        return self._expression_prefix + expression_path + self._expression_suffix
+
+    def to_json_obj(self):
+        if self.test_value is not None:
+            return self.test_value.to_json_obj()
+        return self._to_json(self.value, self.typ)
+
+    def assertion(self, expression_path):
+        """
+        Get the one-line assertion for this field, which must not have a TestValue for its value.
+        """
+        if self._assertion is None:
+            raise RuntimeError(
+                u'Error: assetion unhandled for type {} of field {} with value {}'
+                .format(self.typ, self.name, self.value))
+        return self._assertion(self._expression(expression_path), self.value, self.typ)
+
+    def emit_assert_to(self, lines, indent, expression_path):
+        if self.test_value is not None:
+            self.test_value.emit_asserts_to(lines, indent, self._expression(expression_path))
         else:
-            raise RuntimeError(u'Error: assetion unhandled for type {} of field {} with value {}'
-                               .format(self.typ, self.name, self.value))
+            lines.append(indent + self.assertion(expression_path) + '\n')
+
+
+def _by_type(handlers, typ):
+    """
+    Look up the handler for a Stone type by its exact class, falling back to its superclasses.
+    """
+    handler = handlers.get(type(typ))
+    if handler is None:
+        handler = next((f for cls, f in handlers.items() if isinstance(typ, cls)), None)
+    return handler
+
+
+def _json_unchanged(value, typ):
+    return value
+
+
+def _json_timestamp(value, typ):
+    return _strftime(value, typ.format)
+
+
+def _json_bytes(value, typ):
+    return base64.b64encode(value).decode('ascii')
+
+
+# How the reference serializer represents a primitive-typed field's value before it's dumped, by
+# the field's exact Stone type.
+_JSON_PRIMITIVES = {
+    ir.String: _json_unchanged,
+    ir.Int32: _json_unchanged,
+    ir.UInt32: _json_unchanged,
+    ir.Int64: _json_unchanged,
+    ir.UInt64: _json_unchanged,
+    ir.Float32: _json_unchanged,
+    ir.Float64: _json_unchanged,
+    ir.Boolean: _json_unchanged,
+    ir.Timestamp: _json_timestamp,
+    ir.Bytes: _json_bytes,
+    ir.Void: _json_unchanged,
+}
+
+
+def _assert_string(expression, value, typ):
+    return u'assert_eq!({}.as_str(), {});'.format(expression, _raw_str(value))
+
+
+def _raw_str(s):
+    """
+    Quote a string as a Rust raw string literal, with enough #s that it can't end early.
+    """
+    hashes = u'#'
+    while u'"' + hashes in s:
+        hashes += u'#'
+    return u'r{0}"{1}"{0}'.format(hashes, s)
+
+
+def _assert_numeric(expression, value, typ):
+    return u'assert_eq!({}, {});'.format(expression, value)
+
+
+def _assert_boolean(expression, value, typ):
+    return u'assert_eq!({}, {});'.format(expression, 'true' if value else 'false')
+
+
+def _assert_timestamp(expression, value, typ):
+    return u'assert_eq!({}.as_str(), "{}");'.format(expression, _strftime(value, typ.format))
+
+
+@lru_cache(maxsize=None)
+def _strftime(value, fmt):
+    # All timestamp fields get the same value, and there are only a handful of formats in use.
+    return value.strftime(fmt)
+
+
+def _assert_bytes(expression, value, typ):
+    return u'assert_eq!(&{}, &[{}]);'.format(expression, ",".join(map(str, value)))
+
+
+# How to emit the assertion for a primitive-typed field, by the field's exact Stone type.
+_ASSERTIONS = {
+    ir.String: _assert_string,
+    ir.Int32: _assert_numeric,
+    ir.UInt32: _assert_numeric,
+    ir.Int64: _assert_numeric,
+    ir.UInt64: _assert_numeric,
+    ir.Float32: _assert_numeric,
+    ir.Float64: _assert_numeric,
+    ir.Boolean: _assert_boolean,
+    ir.Timestamp: _assert_timestamp,
+    ir.Bytes: _assert_bytes,
+}
 
 
 class TestValue(object):
@@ -233,9 +561,22 @@ class TestValue(object):
         self.rust_generator = rust_generator
         self.fields = []
         self.value = None
-
-    def emit_asserts(self, codegen, expression_path):
-        raise NotImplementedError('you\'re supposed to implement TestValue.emit_asserts')
+        # Whether to_json_obj() gives what the reference serializer would for the value.
+        self.has_json_obj = False
+
+    def emit_asserts_to(self, lines, indent, expression_path):
+        """
+        Add the lines of Rust asserting that the value at `expression_path` matches this one to
+        `lines`, each indented by `indent` at least and ending in a newline.
+        """
+        raise NotImplementedError('you\'re supposed to implement TestValue.emit_asserts_to')
+
+    def to_json_obj(self):
+        """
+        Get the value as plain Python objects which json.dumps() serializes the same way the
+        reference serializer serializes the value itself. Only valid if has_json_obj is set.
+        """
+        raise NotImplementedError('you\'re supposed to implement TestValue.to_json_obj')
 
     def is_serializable(self):
         # Not all types can round-trip back from Rust to JSON.
@@ -256,27 +597,47 @@ class TestStruct(TestValue):
         self._reference_impls = reference_impls
         self._no_optional_fields = no_optional_fields
 
-        py_name = fmt_py_class(stone_type.name)
         try:
-            self.value = reference_impls[stone_type.namespace.name].__dict__[py_name]()
+            self.value = rust_generator.reference_class(stone_type)()
         except Exception as e:
             raise RuntimeError(u'Error instantiating value for {}: {}'.format(stone_type.name, e))
 
-        for field in (stone_type.all_required_fields if no_optional_fields else stone_type.all_fields):
-            field_value = make_test_field(
-                    field.name, field.data_type, rust_generator, reference_impls)
-            if field_value is None:
-                raise RuntimeError(u'Error: incomplete type generated: {}'.format(stone_type.name))
-            self.fields.append(field_value)
-            try:
-                setattr(self.value, field.name, field_value.value)
-            except Exception as e:
-                raise RuntimeError(u'Error generating value for {}.{}: {}'
-                                   .format(stone_type.name, field.name, e))
+        # Build all the field values first, then store them into the reference instance.
+        stone_fields = list(stone_type.all_required_fields if no_optional_fields
+                            else _all_fields(stone_type))
+        self.fields = [make_test_field(field.name, field.data_type, rust_generator, reference_impls)
+                       for field in stone_fields]
+        if None in self.fields:
+            raise RuntimeError(u'Error: incomplete type generated: {}'.format(stone_type.name))
 
-    def emit_asserts(self, codegen, expression_path):
+        py_class = type(self.value)
+        field = None
+        try:
+            for field, field_value in zip(stone_fields, self.fields):
+                setattr(self.value, field.name, field_value.value)
+        except Exception as e:
+            raise RuntimeError(u'Error generating value for {}.{}: {}'
+                               .format(stone_type.name, field.name, e))
+
+        # The reference serializer writes fields in the order its class lists them: parent fields
+        # first, and each type's own in declaration order (rather than required ones first, as
+        # Stone orders them). Ones with permissions attached come last, so leave those to it.
+        by_name = {field.name: field_value for field, field_value in zip(stone_fields, self.fields)}
+        self._json_fields = [(name, by_name[name])
+                             for name, _ in getattr(py_class, '_all_fields_', ())
+                             if name in by_name]
+        self.has_json_obj = len(self._json_fields) == len(by_name) \
+            and all(field_value.has_json_obj for field_value in self.fields) \
+            and not getattr(py_class, '_all_internal_fields_', None)
+
+    def emit_asserts_to(self, lines, indent, expression_path):
         for field in self.fields:
-            field.emit_assert(codegen, expression_path)
+            field.emit_assert_to(lines, indent, expression_path)
+
+    def to_json_obj(self):
+        # Fields with no value (i.e. void ones) are left out.
+        return {name: field.to_json_obj() for name, field in self._json_fields
+                if field.value is not None}
 
     def test_suffix(self):
         if self._no_optional_fields:
@@ -292,6 +653,8 @@ class TestUnion(TestValue):
         self._rust_name = rust_generator.enum_name(stone_type)
         self._rust_variant_name = rust_generator.enum_variant_name_raw(variant.name)
         self._rust_namespace_name = rust_generator.namespace_name(stone_type.namespace)
+        self._rust_variant_path = u'::dropbox_sdk::{}::{}::{}'.format(
+            self._rust_namespace_name, self._rust_name, self._rust_variant_name)
         self._variant = variant
 
         # We can't serialize the catch-all variant.
@@ -305,47 +668,53 @@ class TestUnion(TestValue):
                                .format(stone_type.name, variant.name))
 
         self.value = self.get_from_inner_value(variant.name, self._inner_value)
+        self.has_json_obj = self._inner_value.has_json_obj
 
     def get_from_inner_value(self, variant_name, generated_field):
-        pyname = fmt_py_class(self._stone_type.name)
         try:
-            return self._reference_impls[self._stone_type.namespace.name] \
-                    .__dict__[pyname](variant_name, generated_field.value)
+            return self.rust_generator.reference_class(self._stone_type)(
+                variant_name, generated_field.value)
         except Exception as e:
             raise RuntimeError(u'Error generating value for {}.{}: {}'
                                .format(self._stone_type.name, variant_name, e))
 
     def has_other_variants(self):
-        return len(self._stone_type.all_fields) > 1 or not self._stone_type.closed
+        return len(_all_fields(self._stone_type)) > 1 or not self._stone_type.closed
 
-    def emit_asserts(self, codegen, expression_path):
+    def emit_asserts_to(self, lines, indent, expression_path):
         if expression_path[0] == '(' and expression_path[-1] == ')':
                 expression_path = expression_path[1:-1]  # strip off superfluous parens
 
-        with codegen.block(u'match {}'.format(expression_path)):
-            if ir.is_void_type(self._variant.data_type):
-                codegen.emit(u'::dropbox_sdk::{}::{}::{} => (),'.format(
-                    self._rust_namespace_name,
-                    self._rust_name,
-                    self._rust_variant_name))
-            elif codegen.is_nullary_struct(self._variant.data_type):
-                codegen.emit(u'::dropbox_sdk::{}::{}::{}(..) => (), // nullary struct'.format(
-                    self._rust_namespace_name,
-                    self._rust_name,
-                    self._rust_variant_name))
-            else:
-                with codegen.block(u'::dropbox_sdk::{}::{}::{}(ref v) =>'.format(
-                        self._rust_namespace_name,
-                        self._rust_name,
-                        self._rust_variant_name)):
-                    self._inner_value.emit_assert(codegen, '(*v)')
+        arm_indent = indent + _INDENT
+        lines.append(u'{}match {} {{\n'.format(indent, expression_path))
+        if ir.is_void_type(self._variant.data_type):
+            lines.append(arm_indent + self._rust_variant_path + u' => (),\n')
+        elif self.rust_generator.is_nullary_struct(self._variant.data_type):
+            lines.append(arm_indent + self._rust_variant_path + u'(..) => (), // nullary struct\n')
+        else:
+            lines.append(arm_indent + self._rust_variant_path + u'(ref v) => {\n')
+            self._inner_value.emit_assert_to(lines, arm_indent + _INDENT, '(*v)')
+            lines.append(arm_indent + u'}\n')
 
-            if self.has_other_variants():
-                codegen.emit(u'_ => panic!("wrong variant")')
+        if self.has_other_variants():
+            lines.append(arm_indent + u'_ => panic!("wrong variant")\n')
+        lines.append(indent + u'}\n')
 
     def is_serializable(self):
         return not self._variant.catch_all
 
+    def to_json_obj(self):
+        tag = self._variant.name
+        if self._inner_value.value is None:
+            return {'.tag': tag}
+        elif isinstance(self._inner_value.test_value, TestStruct):
+            # Struct variants have their fields alongside the tag, not under it.
+            obj = {'.tag': tag}
+            obj.update(self._inner_value.to_json_obj())
+            return obj
+        else:
+            return {'.tag': tag, tag: self._inner_value.to_json_obj()}
+
     def test_suffix(self):
         return "_" + self._rust_variant_name
 
@@ -358,6 +727,11 @@ class TestPolymorphicStruct(TestUnion):
         return len(self._stone_type.get_enumerated_subtypes()) > 1 \
                 or self._stone_type.is_catch_all()
 
+    def to_json_obj(self):
+        obj = {'.tag': self._variant.name}
+        obj.update(self._inner_value.to_json_obj())
+        return obj
+
 
 class TestList(TestValue):
     def __init__(self, rust_generator, stone_type, reference_impls):
@@ -370,9 +744,13 @@ class TestList(TestValue):
             raise RuntimeError(u'Error generating value for list of {}'.format(stone_type.name))
 
         self.value = self._inner_value.value
+        self.has_json_obj = self._inner_value.has_json_obj
+
+    def emit_asserts_to(self, lines, indent, expression_path):
+        self._inner_value.emit_assert_to(lines, indent, expression_path + '[0]')
 
-    def emit_asserts(self, codegen, expression_path):
-        self._inner_value.emit_assert(codegen, expression_path + '[0]')
+    def to_json_obj(self):
+        return [self._inner_value.to_json_obj()]
 
 
 class TestMap(TestValue):
@@ -385,62 +763,169 @@ class TestMap(TestValue):
         self._val_value = make_test_field(None, stone_type.value_data_type, rust_generator,
                                           reference_impls)
         self.value = {self._key_value.value: self._val_value.value}
+        self.has_json_obj = self._key_value.has_json_obj and self._val_value.has_json_obj
 
-    def emit_asserts(self, codegen, expression_path):
+    def emit_asserts_to(self, lines, indent, expression_path):
         key_str = u'["{}"]'.format(self._key_value.value)
-        self._val_value.emit_assert(codegen, expression_path + key_str)
+        self._val_value.emit_assert_to(lines, indent, expression_path + key_str)
+
+    def to_json_obj(self):
+        return {self._key_value.to_json_obj(): self._val_value.to_json_obj()}
+
+
+_TEST_TIMESTAMP = datetime.datetime.utcfromtimestamp(2**33 - 1)
 
 
 def make_test_field(field_name, stone_type, rust_generator, reference_impls):
     rust_name = rust_generator.field_name_raw(field_name) if field_name is not None else None
-    typ, option = ir.unwrap_nullable(stone_type)
-
-    inner = None
-    value = None
-    if ir.is_struct_type(typ):
-        if typ.has_enumerated_subtypes():
-            variant = typ.get_enumerated_subtypes()[0]
-            inner = TestPolymorphicStruct(rust_generator, typ, reference_impls, variant)
-        else:
-            inner = TestStruct(rust_generator, typ, reference_impls)
-        value = inner.value
-    elif ir.is_union_type(typ):
-        # Pick the first tag.
-        # We could generate tests for them all, but it would lead to a huge explosion of tests, and
-        # the types themselves are tested elsewhere.
-        if len(typ.fields) == 0:
-            # there must be a parent type; go for it
-            variant = typ.all_fields[0]
-        else:
-            variant = typ.fields[0]
-        inner = TestUnion(rust_generator, typ, reference_impls, variant)
-        value = inner.value
-    elif ir.is_list_type(typ):
-        inner = TestList(rust_generator, typ.data_type, reference_impls)
-        value = [inner.value]
-    elif ir.is_map_type(typ):
-        inner = TestMap(rust_generator, typ, reference_impls)
-        value = inner.value
-    elif ir.is_string_type(typ):
-        if typ.pattern:
-            value = Unregex(typ.pattern, typ.min_length).generate()
-        elif typ.min_length:
-            value = 'a' * typ.min_length
-        else:
-            value = 'something'
-    elif ir.is_numeric_type(typ):
-        value = typ.max_value or typ.maximum or 1e307
-    elif ir.is_boolean_type(typ):
-        value = True
-    elif ir.is_timestamp_type(typ):
-        value = datetime.datetime.utcfromtimestamp(2**33 - 1)
-    elif ir.is_bytes_type(typ):
-        value = bytes([0,1,2,3,4,5])
-    elif not ir.is_void_type(typ):
+    typ, option, make_value = _field_kind(stone_type)
+    if make_value is None:
         raise RuntimeError(u'Error: unhandled field type of {}: {}'.format(field_name, typ))
+    value, inner = make_value(typ, rust_generator, reference_impls)
     return TestField(rust_name, value, inner, typ, option)
 
 
+@lru_cache(maxsize=None)
+def _field_kind(stone_type):
+    """
+    Unwrap a field's type, returning the underlying type, whether it was nullable, and how to make
+    a test value for it (or None if we can't).
+
+    The same types turn up in fields all over the spec, so the answers are worth keeping.
+    """
+    typ, option = ir.unwrap_nullable(stone_type)
+    return typ, option, _by_type(_FIELD_VALUES, typ)
+
+
+def _struct_field_value(typ, rust_generator, reference_impls):
+    if typ.has_enumerated_subtypes():
+        inner = rust_generator.test_value_for(typ, typ.get_enumerated_subtypes()[0])
+    else:
+        inner = rust_generator.test_value_for(typ)
+    return inner.value, inner
+
+
+def _union_field_value(typ, rust_generator, reference_impls):
+    # Pick the first tag.
+    # We could generate tests for them all, but it would lead to a huge explosion of tests, and
+    # the types themselves are tested elsewhere.
+    if len(typ.fields) == 0:
+        # there must be a parent type; go for it
+        variant = _all_fields(typ)[0]
+    else:
+        variant = typ.fields[0]
+    inner = rust_generator.test_value_for(typ, variant)
+    return inner.value, inner
+
+
+def _list_field_value(typ, rust_generator, reference_impls):
+    inner = TestList(rust_generator, typ.data_type, reference_impls)
+    return [inner.value], inner
+
+
+def _map_field_value(typ, rust_generator, reference_impls):
+    inner = TestMap(rust_generator, typ, reference_impls)
+    return inner.value, inner
+
+
+def _string_field_value(typ, rust_generator, reference_impls):
+    if typ.pattern:
+        return _unregex(typ.pattern, typ.min_length), None
+    elif typ.min_length:
+        return 'a' * typ.min_length, None
+    else:
+        return 'something', None
+
+
+def _numeric_field_value(typ, rust_generator, reference_impls):
+    return _numeric_test_value(typ), None
+
+
+@lru_cache(maxsize=None)
+def _numeric_test_value(typ):
+    # There are only a handful of distinct numeric types, but lots of fields using them.
+    return typ.max_value or typ.maximum or 1e307
+
+
+def _boolean_field_value(typ, rust_generator, reference_impls):
+    return True, None
+
+
+def _timestamp_field_value(typ, rust_generator, reference_impls):
+    return _TEST_TIMESTAMP, None
+
+
+def _bytes_field_value(typ, rust_generator, reference_impls):
+    return bytes([0,1,2,3,4,5]), None
+
+
+def _void_field_value(typ, rust_generator, reference_impls):
+    return None, None
+
+
+# How to make the test value for a field, by the field's exact Stone type (after unwrapping
+# nullable). Each returns the Python value and the TestValue for it, if it has one.
+_FIELD_VALUES = {
+    ir.Struct: _struct_field_value,
+    ir.Union: _union_field_value,
+    ir.List: _list_field_value,
+    ir.Map: _map_field_value,
+    ir.String: _string_field_value,
+    ir.Int32: _numeric_field_value,
+    ir.UInt32: _numeric_field_value,
+    ir.Int64: _numeric_field_value,
+    ir.UInt64: _numeric_field_value,
+    ir.Float32: _numeric_field_value,
+    ir.Float64: _numeric_field_value,
+    ir.Boolean: _boolean_field_value,
+    ir.Timestamp: _timestamp_field_value,
+    ir.Bytes: _bytes_field_value,
+    ir.Void: _void_field_value,
+}
+
+
+# Characters that can be used to satisfy a negated character class, in order of preference.
+_PRINTABLE_NON_WS = tuple(c for c in string.printable if c not in string.whitespace)
+
+# A bit for each of those characters, with more preferred characters in lower bits, so the lowest
+# bit left after masking out a class's rejects is the character to use.
+_PRINTABLE_BITS = {ord(c): 1 << i for i, c in enumerate(_PRINTABLE_NON_WS)}
+_ALL_PRINTABLE_BITS = (1 << len(_PRINTABLE_NON_WS)) - 1
+
+
+def _printable_bits(predicate):
+    return sum(bit for c, bit in _PRINTABLE_BITS.items() if predicate(chr(c)))
+
+
+# The bits of the characters each regex category (\d, \s, \w and their negations) matches.
+_CATEGORY_BITS = {
+    'category_digit': _printable_bits(lambda c: c in string.digits),
+    'category_space': _printable_bits(lambda c: c in string.whitespace),
+    'category_word': _printable_bits(lambda c: c.isalnum() or c == '_'),
+}
+_CATEGORY_BITS.update({name.replace('category_', 'category_not_'): _ALL_PRINTABLE_BITS & ~bits
+                       for name, bits in list(_CATEGORY_BITS.items())})
+
+
+@lru_cache(maxsize=None)
+def _parse_regex(regex_string):
+    # The same patterns show up on lots of fields across the spec, and the parse tree is only ever
+    # read from, so it can be shared.
+    return sre_parse.parse(regex_string)
+
+
+# Characters that make a regex anything other than a literal string.
+_META_RE = re.compile(r'[.^$*+?{}\[\]|()\\]')
+
+
+@lru_cache(maxsize=None)
+def _unregex(regex_string, min_len):
+    if not _META_RE.search(regex_string):
+        # A literal only ever matches itself, whatever the minimum length.
+        return regex_string
+    return Unregex(regex_string, min_len).generate()
+
+
 class Unregex(object):
     """
     Generate a minimal string that passes a regex and optionally is of a given
@@ -449,68 +934,109 @@ class Unregex(object):
     def __init__(self, regex_string, min_len=None):
         self._min_len = min_len
         self._group_refs = {}
-        self._tokens = re.sre_parse.parse(regex_string)
+        self._tokens = _parse_regex(regex_string)
 
     def generate(self):
-        return self._generate(self._tokens)
-
-    def _generate(self, tokens):
-        result = ''
+        parts = []
+        self._generate(self._tokens, parts)
+        return ''.join(parts)
+
+    def _generate(self, tokens, parts):
+        """
+        Append the pieces of the string generated for the given tokens to `parts`.
+        """
         for (opcode, argument) in tokens:
             opcode = str(opcode).lower()
-            if opcode == 'literal':
-                result += chr(argument)
-            elif opcode == 'at':
-                pass  # start or end anchor; nothing to add
-            elif opcode == 'in':
-                if argument[0][0] == 'negate':
-                    rejects = []
-                    for opcode, reject in argument[1:]:
-                        if opcode == 'literal':
-                            rejects.append(chr(reject))
-                        elif opcode == 'range':
-                            for i in range(reject[0], reject[1]):
-                                rejects.append(chr(i))
-                    choices = list(set(string.printable)
-                                   .difference(string.whitespace)
-                                   .difference(rejects))
-                    result += choices[0]
-                else:
-                    result += self._generate([argument[0]])
-            elif opcode == 'any':
-                result += '*'
-            elif opcode == 'range':
-                result += chr(argument[0])
-            elif opcode == 'branch':
-                result += self._generate(argument[1][0])
-            elif opcode == 'subpattern':
-                group_number, add_flags, del_flags, sub_tokens = argument
-                sub_result = self._generate(sub_tokens)
-                self._group_refs[group_number] = sub_result
-                result += sub_result
-            elif opcode == 'groupref':
-                result += self._group_refs[argument]
-            elif opcode == 'min_repeat' or opcode == 'max_repeat':
-                min_repeat, max_repeat, sub_tokens = argument
-                if self._min_len:
-                    n = max(min_repeat, min(self._min_len, max_repeat))
-                else:
-                    n = min_repeat
-                sub_result = self._generate(sub_tokens) if n != 0 else ''
-                result += str(sub_result) * n
-            elif opcode == 'category':
-                if argument == 'category_digit':
-                    result += '0'
-                elif argument == 'category_not_space':
-                    result += '!'
-                else:
-                    raise NotImplementedError('category {}'.format(argument))
-            elif opcode == 'assert_not':
-                # let's just hope for the best...
-                pass
-            elif opcode == 'assert' or opcode == 'negate':
-                # note: 'negate' is handled in the 'in' opcode
-                raise NotImplementedError('regex opcode {} not implemented'.format(opcode))
-            else:
+            handler = self._OPCODE_HANDLERS.get(opcode)
+            if handler is None:
+                if opcode == 'assert' or opcode == 'negate':
+                    # note: 'negate' is handled in the 'in' opcode
+                    raise NotImplementedError('regex opcode {} not implemented'.format(opcode))
                 raise NotImplementedError('unknown regex opcode: {}'.format(opcode))
-        return result
+            handler(self, argument, parts)
+
+    def _literal(self, argument, parts):
+        parts.append(chr(argument))
+
+    def _in(self, argument, parts):
+        if str(argument[0][0]).lower() == 'negate':
+            rejects = 0
+            for opcode, reject in argument[1:]:
+                opcode = str(opcode).lower()
+                if opcode == 'literal':
+                    rejects |= _PRINTABLE_BITS.get(reject, 0)
+                elif opcode == 'range':
+                    lo, hi = reject
+                    for c, bit in _PRINTABLE_BITS.items():
+                        if lo <= c <= hi:
+                            rejects |= bit
+                elif opcode == 'category' and str(reject).lower() in _CATEGORY_BITS:
+                    rejects |= _CATEGORY_BITS[str(reject).lower()]
+                else:
+                    raise NotImplementedError(
+                        'regex opcode {} in a negated character class'.format(opcode))
+            allowed = _ALL_PRINTABLE_BITS & ~rejects
+            if not allowed:
+                raise NotImplementedError(
+                    'negated character class rejects every printable character')
+            parts.append(_PRINTABLE_NON_WS[(allowed & -allowed).bit_length() - 1])
+        else:
+            self._generate([argument[0]], parts)
+
+    def _any(self, argument, parts):
+        parts.append('*')
+
+    def _range(self, argument, parts):
+        parts.append(chr(argument[0]))
+
+    def _branch(self, argument, parts):
+        self._generate(argument[1][0], parts)
+
+    def _subpattern(self, argument, parts):
+        group_number, add_flags, del_flags, sub_tokens = argument
+        start = len(parts)
+        self._generate(sub_tokens, parts)
+        self._group_refs[group_number] = ''.join(parts[start:])
+
+    def _groupref(self, argument, parts):
+        parts.append(self._group_refs[argument])
+
+    def _repeat(self, argument, parts):
+        min_repeat, max_repeat, sub_tokens = argument
+        if self._min_len:
+            n = max(min_repeat, min(self._min_len, max_repeat))
+        else:
+            n = min_repeat
+        if n != 0:
+            sub_parts = []
+            self._generate(sub_tokens, sub_parts)
+            parts.append(''.join(sub_parts) * n)
+
+    def _category(self, argument, parts):
+        category = str(argument).lower()
+        if category == 'category_digit':
+            parts.append('0')
+        elif category == 'category_not_space':
+            parts.append('!')
+        else:
+            raise NotImplementedError('category {}'.format(argument))
+
+    def _nothing(self, argument, parts):
+        # 'at' is a start or end anchor, and for 'assert_not'... let's just hope for the best.
+        pass
+
+    # How to handle each regex opcode, by its lowercased name.
+    _OPCODE_HANDLERS = {
+        'literal': _literal,
+        'at': _nothing,
+        'in': _in,
+        'any': _any,
+        'range': _range,
+        'branch': _branch,
+        'subpattern': _subpattern,
+        'groupref': _groupref,
+        'min_repeat': _repeat,
+        'max_repeat': _repeat,
+        'category': _category,
+        'assert_not': _nothing,
+    }
@@ -29371,6 +29371,7 @@ impl ::std::error::Error for UserSelectorError {
 }
 
 impl ::std::fmt::Display for UserSelectorError {
+    #[inline]
     fn fmt(&self, f: &mut ::std::fmt::Formatter<'_>) -> ::std::fmt::Result {
         match self {
             UserSelectorError::UserNotFound => f.write_str("No matching user found. The provided team_member_id, email, or external_id does not exist on this team."),
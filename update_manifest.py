@@ -7,16 +7,25 @@ from typing import Dict, Set
 
 from generate import spec_files
 
+# Lines starting with these begin the definitions in a spec file, which follow all its imports.
+DEFINITION_KEYWORDS = ('struct ', 'union ', 'union_closed ', 'route ', 'alias ', 'annotation ',
+                       'annotation_type ')
+
 def update_manifest(stone_root: str):
     stone_files = spec_files(stone_root)
 
     deps: Dict[str, Set[str]] = {}
     for filepath in stone_files:
         module = None
+        imports = set()
         with open(filepath) as f:
             for line in f:
                 if line.startswith('namespace '):
-                    module = line.strip().split('namespace ')[1]
+                    module = line[len('namespace '):].strip()
+                elif line.startswith('import '):
+                    imports.add(line[len('import '):].strip())
+                elif line.startswith(DEFINITION_KEYWORDS):
+                    # imports all come before the first definition, so that's everything
                     break
         if module is None or module == "":
             # this can happen if the stone file is empty
@@ -25,13 +34,7 @@ def update_manifest(stone_root: str):
         print('{} = {}'.format(filepath, module))
         if module == "stone_cfg":
             continue
-        if not module in deps:
-            deps[module] = set()
-        with open(filepath) as f:
-            for line in f:
-                if line.startswith('import '):
-                    imported = line.strip().split('import ')[1]
-                    deps[module].add(imported)
+        deps.setdefault(module, set()).update(imports)
 
     with open('namespaces.dot', 'w') as dot:
         dot.write('digraph deps {\n')
@@ -44,43 +47,40 @@ def update_manifest(stone_root: str):
                     ' '.join(sorted(imports))))
         dot.write('}\n')
 
-    # super hacky toml reader and editor
-    in_features = False
-    in_default = False
-    with open("Cargo.toml", "r") as old, open("Cargo.toml.new", "w") as new:
-        for line in old:
-            if in_default:
-                if line.startswith("    \"dbx_"):
-                    in_features = True
-                    continue
-                else:
-                    # found the end
-                    # write an indented list of features
-                    for module in sorted(deps):
-                        new.write('    "dbx_{}",\n'.format(module))
+    # Rewrite the dbx_* features, and the dbx_* entries in the default features, in place. Only
+    # those lines are touched, so the rest of Cargo.toml keeps its formatting and comments.
+    feature_lines = []
+    default_lines = []
+    for module in sorted(deps):
+        feature_lines.append('dbx_{} = [{}]\n'.format(
+            module,
+            ', '.join(['"dbx_{}"'.format(x) for x in sorted(deps[module])])))
+        default_lines.append('    "dbx_{}",\n'.format(module))
 
-                    in_features = False
-                    in_default = False
-            elif in_features:
-                if line.startswith("dbx_"):
-                    continue
-                else:
-                    # found the end of the features list.
-                    # write out the new features list
-                    for module in sorted(deps):
-                        new.write('dbx_{} = [{}]\n'.format(
-                            module,
-                            ', '.join(['"dbx_{}"'.format(x) for x in sorted(deps[module])])))
-                    in_features = False
-            else:
-                if line.startswith('dbx_'):
-                    in_features = True
-                    continue
-                elif line == 'default = [\n':
-                    in_default = True
+    with open("Cargo.toml") as f:
+        old = f.readlines()
 
-            new.write(line)
+    new = []
+    in_default = False
+    for line in old:
+        stripped = line.strip()
+        if in_default:
+            if stripped.startswith('"dbx_'):
+                continue
+            # found the end of the dbx_* entries
+            new += default_lines
+            in_default = False
+        elif stripped.startswith('dbx_'):
+            # the first of the dbx_* features is where the whole new list goes
+            new += feature_lines
+            feature_lines = []
+            continue
+        elif stripped.replace(' ', '') == 'default=[':
+            in_default = True
+        new.append(line)
 
+    with open("Cargo.toml.new", "w") as f:
+        f.writelines(new)
     os.replace("Cargo.toml.new", "Cargo.toml")
 
 
@@ -42,7 +42,12 @@ def main():
     generate_code(args.spec_path, gen_rust=True, gen_test=False)
     update_manifest(args.spec_path)
 
-    cargo_result = subprocess.run(["cargo", "test"])
+    # Build the tests separately first, so a failure to build can be told apart from failing tests.
+    build_result = subprocess.run(["cargo", "test", "--no-run"])
+    if build_result.returncode == 0:
+        cargo_result = subprocess.run(["cargo", "test"])
+    else:
+        cargo_result = build_result
     if cargo_result.returncode == 0:
         print()
         print("Tests from the old spec succeeded.")
@@ -51,7 +56,10 @@ def main():
         print("Bump the patch version number before doing a release.")
     else:
         print()
-        print("Tests from the old spec failed or failed to build.")
+        if cargo_result is build_result:
+            print("Tests from the old spec failed to build.")
+        else:
+            print("Tests from the old spec failed.")
         print()
         print("This means the update is likely not semver-compatible.")
         print("Bump the minor version number before doing a release.")